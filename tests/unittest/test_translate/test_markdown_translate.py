@@ -0,0 +1,223 @@
+import asyncio
+import sys
+import types
+
+import pytest
+
+# client_llm 在导入时读取 API_KEYS.json 并加载各家 LLM SDK，测试中以桩模块替代，所有请求都通过 monkeypatch 模拟
+_client_stub = types.ModuleType('translate.client_llm')
+_client_stub.aclient_qwen = None
+sys.modules.setdefault('translate.client_llm', _client_stub)
+
+from translate import markdown_translate as mt  # noqa: E402
+
+
+class CharEncoding:
+    """每个字符计为一个标记的编码器，标记数可按字符直接相加，便于构造期望结果。"""
+
+    def encode(self, text):
+        return list(text)
+
+    encode_ordinary = encode
+
+    def encode_ordinary_batch(self, texts, num_threads=8):
+        return [self.encode(text) for text in texts]
+
+
+@pytest.fixture(autouse=True)
+def char_encoding(monkeypatch):
+    monkeypatch.setattr(mt, '_get_encoding', lambda name: CharEncoding())
+
+
+# 覆盖三级分割（标题、段落、句子）的固定输入，期望结果与改为按片段累加标记数之前的 split_text 一致
+SPLIT_TEXT = ("# Intro\nA short opening line.\n"
+              "## Details\nFirst paragraph here.\n\nSecond one is a bit longer than that.\n\nThird.\n"
+              "## End\nOne. Two! Three? Done.")
+
+
+@pytest.mark.parametrize('lens, expected', [
+    ([3, 3, 3, 3], [2, 4]),
+    ([5, 2, 7], [1]),  # 下限 5 可取到，之后累计 9 超出上限
+    ([7], [1]),  # 上限 7 可取到
+    ([4, 4], []),  # 累计从 4 直接跳到 8，越过整个区间
+    ([10, 1, 6], []),  # 超出上限后不会重置，继续累加
+    ([], []),
+])
+def test_walk_window(lens, expected):
+    assert mt._walk_window(lens, 5, 7) == expected
+
+
+@pytest.mark.parametrize('max_tokens, flexibility, expected', [
+    (30, 0.5, ['# Intro\nA short opening line.', '## Details\nFirst paragraph here.',
+               'Second one is a bit longer than that.', 'Third.\n## End\nOne. Two! Three? Done.']),
+    # 分隔符属于下一个片段，块边界可能落在标题标记之后
+    (60, 0.5, ['# Intro\nA short opening line.\n##',
+               'Details\nFirst paragraph here.\n\nSecond one is a bit longer than that.\n\nThird.',
+               '## End\nOne. Two! Three? Done.']),
+    # 所有累计值都超出上限，整段作为剩余部分返回
+    (10, 0.5, [SPLIT_TEXT]),
+    # 灵活性为 0 时上下限相等，只有恰好 30 个标记的窗口才会成块
+    (30, 0.0, ['# Intro\nA short opening line.',
+               '## Details\nFirst paragraph here.\n\nSecond one is a bit longer than that.\n\nThird.\n'
+               '## End\nOne. Two! Three? Done.']),
+    (31, 0.0, [SPLIT_TEXT]),
+    # 灵活性为 1 时下限为 0，空片段也会单独成块
+    (30, 1.0, ['# Intro\nA short opening line.', '##', 'Details\nFirst paragraph here.', '',
+               'Second one is a bit longer than that.', '', 'Third.\n## End\nOne. Two! Three? Done.']),
+])
+def test_split_text(max_tokens, flexibility, expected):
+    assert mt.split_text(SPLIT_TEXT, max_tokens, flexibility) == expected
+
+
+def test_prompt_builder_matches_format_map():
+    template = "从 {source_lang} 到 {target_lang}：\n{original_text}\n---\n{translated_text}\n{source_lang}"
+    build = mt._prompt_builder(template, ('original_text', 'translated_text'), source_lang='en', target_lang='zh')
+    for original, translated in [('a {x} b', '译文'), ('a', {'attention': '注意', 'translation': '译文'})]:
+        expected = template.format_map({'source_lang': 'en', 'target_lang': 'zh', 'original_text': original,
+                                        'translated_text': translated})
+        assert build(original, translated) == expected
+
+
+def test_group_chunks_by_tokens():
+    chunks = ['a' * 3, 'b' * 4, 'c' * 2, 'd' * 9, 'e']
+    assert mt.group_chunks_by_tokens(chunks, 7) == [[0, 1], [2], [3], [4]]
+    assert mt.group_chunks_by_tokens(chunks, 100) == [[0, 1, 2, 3, 4]]
+    assert mt.group_chunks_by_tokens([], 7) == []
+
+
+def _fake_completion(response, calls):
+    async def get_completion(prompt, **kwargs):
+        calls.append(kwargs)
+        return response
+    return get_completion
+
+
+def test_get_completion_retries_dict_without_key(monkeypatch):
+    replies = [{'translation': '译文'}, {'translate': '译文'}]
+
+    async def aclient_qwen(system_message, prompt, model, result_format):
+        return replies.pop(0), 1
+
+    monkeypatch.setattr(mt, 'aclient_qwen', aclient_qwen)
+    monkeypatch.setattr(mt, '_retry_delay', lambda error, retries: 0)
+    monkeypatch.setattr(mt, 'log_error_as_json', lambda *args: None)
+    assert asyncio.run(mt.get_completion('prompt')) == '译文'
+    assert replies == []
+
+
+def test_batch_translate_scatters_by_id(monkeypatch):
+    calls = []
+    response = [
+        {'id': 2, 'translate': 'C'},
+        {'id': 0, 'translate': 'A'},
+        {'id': 7, 'translate': 'out of range'},
+        {'id': 1, 'translate': None},
+        'not a dict',
+    ]
+    monkeypatch.setattr(mt, 'get_completion', _fake_completion(response, calls))
+    result = asyncio.run(mt.batch_translate('system', lambda items: items, ['a', 'b', 'c']))
+    assert result == ['A', None, 'C']
+    # 批量请求只尝试一次，解析失败直接回退为逐块翻译
+    assert calls[0]['max_retries'] == 1
+    assert calls[0]['result_key'] == 'translations'
+
+
+def test_batch_translate_unparsable_reply(monkeypatch):
+    monkeypatch.setattr(mt, 'get_completion', _fake_completion('\n\n未成功获取LLM结果\n\n', []))
+    assert asyncio.run(mt.batch_translate('system', lambda items: items, ['a', 'b'])) == [None, None]
+
+
+def test_batch_fallback_respects_semaphore(monkeypatch):
+    in_flight = 0
+    peak = 0
+
+    async def get_completion(prompt, system_message='', result_format='message', max_retries=5,
+                             result_key='translate'):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+        if result_key == 'translations':
+            return {'unexpected': []}  # 批量结果缺少 translations 字段，全部块回退为逐块翻译
+        return prompt[-8:]
+
+    monkeypatch.setattr(mt, 'get_completion', get_completion)
+    source_text = '\n\n'.join('paragraph %02d ' % i + 'x' * 40 for i in range(60))
+    result = asyncio.run(mt.translate_markdown('en', 'zh', 'cn', source_text, max_tokens=60,
+                                               semaphore_limit=2, batch_max_tokens=400))
+    assert peak <= 2
+    assert '未成功' not in result
+
+
+def _three_chunks(monkeypatch, improve):
+    """将文本固定分为 a、b、c 三块，初次翻译原样返回，改进翻译由 improve 决定。"""
+    async def one_chunk_translation(system_message, prompt_template, source_text, result_format):
+        return source_text
+
+    async def one_chunk_improve_translation(system_message, prompt_template, original_text, translated_text,
+                                            result_format):
+        return await improve(original_text)
+
+    monkeypatch.setattr(mt, 'split_text', lambda text, max_tokens: ['a', 'b', 'c'])
+    monkeypatch.setattr(mt, 'one_chunk_translation', one_chunk_translation)
+    monkeypatch.setattr(mt, 'one_chunk_improve_translation', one_chunk_improve_translation)
+    monkeypatch.setattr(mt, 'log_detailed_error', lambda *args: None)
+    return asyncio.run(mt.translate_markdown('en', 'zh', 'cn', 'x' * 400, max_tokens=10, semaphore_limit=3))
+
+
+def test_non_str_result_is_retried_in_order(monkeypatch):
+    attempts = {'b': 0, 'c': 0}
+
+    async def improve(chunk):
+        if chunk == 'a':
+            await asyncio.sleep(0.01)  # 第一块最后完成，后面的块先暂存
+            return 'A'
+        attempts[chunk] += 1
+        if attempts[chunk] == 1:
+            return {'translation': chunk.upper()}  # 缺少 translate 字段的结果
+        return chunk.upper()
+
+    assert _three_chunks(monkeypatch, improve) == 'A\n\nB\n\nC'
+    assert attempts == {'b': 2, 'c': 2}
+
+
+def test_non_str_result_exhausts_retries(monkeypatch):
+    async def improve(chunk):
+        if chunk == 'a':
+            await asyncio.sleep(0.01)
+            return 'A'
+        if chunk == 'b':
+            return {'translation': 'B'}
+        return 'C'
+
+    monkeypatch.setattr(mt, 'CHUNK_MAX_RETRIES', 1)
+    result = _three_chunks(monkeypatch, improve).split('\n\n')
+    assert result[0] == 'A'
+    assert result[-1] == 'C'
+    assert '未成功获取LLM结果' in ''.join(result[1:-1])
+
+
+@pytest.mark.parametrize('length, counted, split', [
+    (3600, True, False),  # 估算 900 略超上限，精确计数 750 后不分块
+    (6400, False, True),  # 估算 1600 达到上限两倍，跳过精确计数直接分块
+])
+def test_split_decision(monkeypatch, length, counted, split):
+    calls = {'count': False, 'split': False}
+
+    def num_tokens_in_string(text):
+        calls['count'] = True
+        return 750
+
+    def split_text(text, max_tokens):
+        calls['split'] = True
+        return [text]
+
+    async def get_completion(prompt, **kwargs):
+        return 'ok'
+
+    monkeypatch.setattr(mt, 'num_tokens_in_string', num_tokens_in_string)
+    monkeypatch.setattr(mt, 'split_text', split_text)
+    monkeypatch.setattr(mt, 'get_completion', get_completion)
+    asyncio.run(mt.translate_markdown('en', 'zh', 'cn', 'x' * length, max_tokens=800))
+    assert calls == {'count': counted, 'split': split}
@@ -4,9 +4,10 @@
 导出内容：
 - MarkdownMapper: 处理Markdown文件中的公式、图片等不需要翻译的部分。
 - translate_markdown: 异步翻译Markdown文本。
+- warm_encoding: 在后台线程中预加载分块所需的 tiktoken 编码。
 """
 
 from .markdown_preprocess import MarkdownMapper
-from .markdown_translate import translate_markdown
+from .markdown_translate import translate_markdown, warm_encoding
 
-__all__ = ['MarkdownMapper', 'translate_markdown']
+__all__ = ['MarkdownMapper', 'translate_markdown', 'warm_encoding']
@@ -1,13 +1,19 @@
-from transformers import M2M100Tokenizer
+import tiktoken
 
-# 加载分词器
-tokenizer = M2M100Tokenizer.from_pretrained("facebook/m2m100_418M")
 
-# 要统计的文本
-text = "Hello, how are you?"
+def main():
+    # 与 markdown_translate 的分块计数使用同一编码，无需下载额外的分词模型
+    encoding = tiktoken.get_encoding("cl100k_base")
 
-# 使用分词器编码文本
-tokens = tokenizer.encode(text)
+    # 要统计的文本
+    text = "Hello, how are you?"
 
-# 输出 token 数量
-print("Number of tokens:", len(tokens))
+    # 使用编码器编码文本
+    tokens = encoding.encode(text)
+
+    # 输出 token 数量
+    print("Number of tokens:", len(tokens))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import atexit
 import base64
 import time
 
+import aiohttp
 import openai
 import requests
 import os
@@ -12,6 +15,7 @@ from queue import Queue
 import traceback
 import re
 import json
+import orjson
 import traceback
 from typing import Union, List
 from typing import List, Tuple, Optional
@@ -25,6 +29,16 @@ file_path = os.path.join(current_dir, "API_KEYS.json")
 with open(file_path, 'r', encoding='utf-8') as f:
     json_keys = json.load(f)
 
+# DashScope 原生文本生成接口，与 dashscope.Generation.call 使用的是同一个接口
+DASHSCOPE_GENERATION_URL = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
+
+# 支持 JSON 模式（response_format={"type": "json_object"}）的模型名前缀，其他模型不发送该参数
+JSON_MODE_MODEL_PREFIXES = ("qwen-max", "qwen-plus", "qwen-turbo", "qwen2.5-")
+
+# 复用的 aiohttp 会话及其所属的事件循环，首次调用 aclient_qwen 时创建
+_aiohttp_session: Optional[aiohttp.ClientSession] = None
+_aiohttp_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
 
 # 编码图像的函数
 def encode_image(image_path):
@@ -111,6 +125,110 @@ def client_qwen(system_message: str, user_message: str, model: str = "qwen2-72b-
         return error_message, None
 
 
+def _get_aiohttp_session() -> aiohttp.ClientSession:
+    """
+    获取模块级复用的 aiohttp 会话，会话与事件循环绑定，事件循环变化时重新创建。
+
+    Returns:
+        aiohttp.ClientSession: 当前事件循环可用的会话。
+    """
+    global _aiohttp_session, _aiohttp_session_loop
+    loop = asyncio.get_running_loop()
+    if _aiohttp_session is None or _aiohttp_session.closed or _aiohttp_session_loop is not loop:
+        _aiohttp_session = aiohttp.ClientSession()
+        _aiohttp_session_loop = loop
+    return _aiohttp_session
+
+
+async def close_aiohttp_session():
+    """
+    关闭复用的 aiohttp 会话。应在创建该会话的事件循环结束前调用，例如每次 asyncio.run 的末尾。
+    """
+    global _aiohttp_session, _aiohttp_session_loop
+    if _aiohttp_session is not None and not _aiohttp_session.closed:
+        await _aiohttp_session.close()
+    _aiohttp_session = None
+    _aiohttp_session_loop = None
+
+
+def _close_aiohttp_session_at_exit():
+    """
+    进程退出时关闭仍未关闭的 aiohttp 会话。所属事件循环已关闭或仍在运行时无法再等待关闭，直接跳过。
+    """
+    loop = _aiohttp_session_loop
+    if _aiohttp_session is None or _aiohttp_session.closed or loop.is_closed() or loop.is_running():
+        return
+    loop.run_until_complete(close_aiohttp_session())
+
+
+atexit.register(_close_aiohttp_session_at_exit)
+
+
+async def aclient_qwen(system_message: str, user_message: str, model: str = "qwen2-72b-instruct",
+                       temperature: float = 0.1, result_format: str = "text"):
+    """
+    client_qwen 的异步版本，直接通过 aiohttp 请求 DashScope，不占用线程池。仅支持非图像模式。
+
+    Args:
+        system_message (str): 系统消息。为空时使用默认值。
+        user_message (str): 用户消息。
+        model (str): 使用的模型。默认为 "qwen2-72b-instruct"。
+        temperature (float): 温度。默认为0.1。
+        result_format (str): 返回格式。[text|message]，默认为text，当为message时输出json内容，
+            模型支持时（见 JSON_MODE_MODEL_PREFIXES）开启 JSON 模式
+
+    Returns:
+        tuple: 返回响应内容和token使用数量。message 格式下为解析后的 JSON，
+            未开启 JSON 模式且内容不是合法 JSON 时为原始字符串。
+
+    Raises:
+        aiohttp.ClientResponseError: 请求返回非 200 状态码时抛出，由调用方决定是否重试。
+        orjson.JSONDecodeError: 开启 JSON 模式时返回内容不是合法 JSON 时抛出。
+    """
+    # 通义千问的系统信息不能为空，所以必须给一个默认值。
+    system_message = "你是一个帮助用户回答问题的助手。" if not system_message else system_message
+    if result_format == 'message':
+        system_message += "\n结果以json格式输出，且只输出json内容，不要有其他内容。"
+    payload = {
+        "model": model,
+        "input": {
+            "messages": [
+                {"role": "system", "content": system_message},
+                {'role': 'user', 'content': user_message}]
+        },
+        "parameters": {
+            "temperature": temperature,
+            "result_format": result_format
+        }
+    }
+    json_mode = result_format == 'message' and model.startswith(JSON_MODE_MODEL_PREFIXES)
+    if json_mode:
+        # JSON 模式：模型保证输出合法的 JSON 对象，不会带有 ```json 代码块等多余内容
+        payload["parameters"]["response_format"] = {"type": "json_object"}
+    headers = {"Authorization": f"Bearer {json_keys['cstore_dashscope']}"}
+
+    async with _get_aiohttp_session().post(DASHSCOPE_GENERATION_URL, json=payload, headers=headers) as resp:
+        if resp.status != HTTPStatus.OK:
+            # 先检查状态码：错误响应体可能为空或是网关返回的 HTML，不能按 JSON 解析，
+            # 否则抛出的就不是 ClientResponseError，调用方也就拿不到 429 的 Retry-After
+            body = await resp.text(errors='replace')
+            print('Status code: %s, response body: %s' % (resp.status, body[:500]))
+            resp.raise_for_status()
+        response = await resp.json(loads=orjson.loads, content_type=None)
+
+    if result_format == 'text':
+        return response['output']['text'], response['usage']['total_tokens']
+    else:  # json 格式的
+        content = response['output']['choices'][0]['message']['content']
+        try:
+            result_json = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            if json_mode:
+                raise
+            result_json = content  # 未开启 JSON 模式时模型可能输出多余内容，原样返回
+        return result_json, response['usage']['total_tokens']
+
+
 def client_qianfan(
         prompt: str,
         system_message: str = "You are a helpful assistant.",
@@ -1,6 +1,7 @@
 import traceback
 
-from translate import MarkdownMapper, translate_markdown
+from translate import MarkdownMapper, translate_markdown, warm_encoding
+from translate.client_llm import close_aiohttp_session
 import chardet
 import os
 import logging
@@ -29,6 +30,8 @@ def create_output_directory(base_dir, original_file_name):
 
 
 async def process_markdown_file(file_path, source_lang, target_lang, country, result_format='message'):
+    # 预处理和保存中间文件期间在后台加载 tiktoken 编码
+    warm_encoding()
     try:
         if os.path.exists(file_path):
             # 创建输出目录
@@ -83,6 +86,9 @@ async def process_markdown_file(file_path, source_lang, target_lang, country, re
     except Exception as e:
         logging.error(f"Error processing file {file_path}: {traceback.format_exc()}")
         raise  # 重新抛出异常，以便主程序可以捕获它
+    finally:
+        # 每个文件在独立的事件循环中处理，结束前关闭该循环中复用的 HTTP 会话
+        await close_aiohttp_session()
 
 
 def save_markdown_as_pdf(markdown_text, pdf_file_path):
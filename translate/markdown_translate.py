@@ -1,23 +1,207 @@
+from __future__ import annotations
+
+import atexit
+import importlib
+import io
 import os
+import queue
+import random
 import re
-from typing import List, Union
-import tiktoken
+import threading
+import weakref
+from typing import TYPE_CHECKING, Callable, List, Tuple, Union
 from icecream import ic
-from .client_llm import client_qwen
+from .client_llm import aclient_qwen
 import asyncio
 from asyncio import Semaphore
 import functools
 import logging
-import uuid
-import json
+import itertools
+import time
+import orjson
 import traceback
 
+if TYPE_CHECKING:
+    import tiktoken
+
 # 设置每个文本块的最大标记数量，如果文本超过这个标记数量，我们将把它分成多个块
 TOKENS_PER_CHUNK = 800
 
+# 单个文本块处理失败后的最大重试次数
+CHUNK_MAX_RETRIES = 5
+
+# tiktoken 批量编码时的线程数上限
+ENCODE_MAX_THREADS = 8
+# 片段总字符数不低于该值时才多线程批量编码；文本较短时每次创建线程池的开销超过编码本身
+ENCODE_BATCH_MIN_CHARS = 256 * 1024
+
+
+def _available_cpus() -> int:
+    """
+    获取当前进程可用的 CPU 数。os.cpu_count() 返回的是整机核数，不考虑 CPU 亲和性与容器的限制。
+
+    返回值:
+        int: 可用的 CPU 数，至少为 1。
+    """
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:  # Windows 和 macOS 没有 sched_getaffinity
+        return os.cpu_count() or 1
+
+
+# tiktoken 批量编码时使用的线程数，其 Rust 实现在编码期间释放 GIL
+ENCODE_THREADS = min(ENCODE_MAX_THREADS, _available_cpus())
+
+# tiktoken 在首次计数时才导入，只用到 LLM 翻译流程时不必承担其加载开销
+_tiktoken = None
+
+# 与 Python re 的 \s 等价的空白字符集合（即 str.isspace() 为真的字符）。
+# RE2 的 \s 只匹配 ASCII 空白，显式列出后两种引擎对全角空格、不换行空格等的分割结果一致
+_WHITESPACE = '\t\n\x0b\x0c\r\x1c-\x1f \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000'
+
+# split_text 的分割模式，按优先级排列
+# 优先级 1: 标题分割
+_TITLE_PATTERN = '(\n#+[' + _WHITESPACE + '])'
+# 优先级 2: 段落分割
+_PARA_PATTERN = r'(\n{2,})'
+# 优先级 3: 句子结束符分割
+_SENT_PATTERN = r'([\.\!\?][' + _WHITESPACE + '])'
+
+
+def _load_split_re():
+    """
+    选择编译分割模式的正则模块。google-re2 基于 DFA，扫描耗时与文本长度线性相关，优先使用；
+    未安装时回退到标准库 re。名为 re2 的模块还可能是 API 或语义不同的其他实现（如 pyre2、fb-re2），
+    因此先用探测文本比对各模式的分割结果，与 re 不一致时同样回退。
+
+    返回值:
+        module: re2 或 re 模块。
+    """
+    try:
+        import re2
+    except ImportError:
+        return re
+
+    probe = "# a\n## b.\u3000c!\xa0d\n\n\ne? f.\x85g\n#\th"
+    try:
+        for pattern in (_TITLE_PATTERN, _PARA_PATTERN, _SENT_PATTERN):
+            if re2.compile(pattern).split(probe) != re.compile(pattern).split(probe):
+                return re
+    except Exception:
+        return re
+    return re2
+
+
+_split_re = _load_split_re()
+
+# 在模块加载时编译一次
+_TITLE_RE = _split_re.compile(_TITLE_PATTERN)
+_PARA_RE = _split_re.compile(_PARA_PATTERN)
+_SENT_RE = _split_re.compile(_SENT_PATTERN)
+
 # 配置日志记录，记录错误信息到 'error_log.txt' 文件中
 logging.basicConfig(filename='error_log.txt', level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# 重试前等待时间的上限（秒）
+RETRY_MAX_DELAY = 60
+
+# 错误ID使用模块加载时间、进程号及自增计数器拼接，生成ID时无需读取系统随机数
+_error_id_start = f"{int(time.time()):x}"
+_error_counter = itertools.count()
+
+
+def _new_error_id() -> str:
+    """
+    生成用于关联日志的错误ID，在同一日志文件的多次运行之间保持唯一。
+
+    返回值:
+        str: 形如 "<启动时间>-<进程号>-<序号>" 的十六进制ID。
+    """
+    # 进程号每次现取：fork 出的子进程会继承计数器的当前值，只有进程号能区分父子进程
+    return f"{_error_id_start}-{os.getpid():x}-{next(_error_counter):x}"
+
+
+# 后台线程每次最多合并写入的 JSON 日志条数
+LOG_BATCH_SIZE = 64
+
+# JSON 错误日志队列，元素为 (文件路径, 日志数据, orjson 序列化选项)，由后台线程批量写入，避免在事件循环中频繁打开文件。
+# 队列和写入线程在首次记录日志时才创建，仅导入模块时不启动线程
+_log_queue: "queue.Queue[tuple] | None" = None
+_log_thread: "threading.Thread | None" = None
+_log_lock = threading.Lock()
+
+
+def _log_writer(log_queue: "queue.Queue[tuple]"):
+    """
+    后台线程：从日志队列中取出记录，按文件分组后每批只打开一次文件追加写入。
+
+    参数:
+        log_queue (queue.Queue): 要消费的日志队列。
+    """
+    while True:
+        records = [log_queue.get()]
+        while len(records) < LOG_BATCH_SIZE:
+            try:
+                records.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            lines_by_path = {}
+            for path, error_data, option in records:
+                # 每条日志以换行结尾，orjson 直接输出 UTF-8 字节
+                lines_by_path.setdefault(path, []).append(
+                    orjson.dumps(error_data, option=option | orjson.OPT_APPEND_NEWLINE))
+            for path, lines in lines_by_path.items():
+                with open(path, 'ab') as f:
+                    f.write(b''.join(lines))
+        except Exception:
+            logging.error(f"写入 JSON 错误日志失败: {traceback.format_exc()}")
+        finally:
+            for _ in records:
+                log_queue.task_done()
+
+
+def _enqueue_log(record: tuple):
+    """
+    将一条日志记录放入队列，写入线程尚未启动时先启动它。
+
+    参数:
+        record (tuple): (文件路径, 日志数据, orjson 序列化选项)。
+    """
+    global _log_queue, _log_thread
+    with _log_lock:
+        if _log_thread is None:
+            _log_queue = queue.Queue()
+            _log_thread = threading.Thread(target=_log_writer, args=(_log_queue,),
+                                           name="translate-error-log-writer", daemon=True)
+            _log_thread.start()
+        _log_queue.put_nowait(record)
+
+
+def _flush_log_queue():
+    """
+    进程退出前等待队列中的日志全部写入。
+    """
+    if _log_thread is not None and _log_thread.is_alive():
+        _log_queue.join()
+
+
+def _reset_log_writer_after_fork():
+    """
+    fork 出的子进程中只有调用 fork 的线程存活，父进程的写入线程不会被复制，
+    其队列和锁也可能停留在被占用的状态，因此全部丢弃，由子进程首次记录日志时重新创建。
+    """
+    global _log_queue, _log_thread, _log_lock
+    _log_queue = None
+    _log_thread = None
+    _log_lock = threading.Lock()
+
+
+atexit.register(_flush_log_queue)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_log_writer_after_fork)
+
 
 def log_error_as_json(unique_id, prompt, system_message, result_format, error):
     """
@@ -37,10 +221,8 @@ def log_error_as_json(unique_id, prompt, system_message, result_format, error):
         "Result format": result_format,
         "Error": str(error)
     }
-    # 将错误信息保存为 JSON 格式
-    with open('error_log.json', 'a', encoding='utf-8') as f:
-        json.dump(error_data, f, ensure_ascii=False)
-        f.write('\n')  # 确保每条日志占一行
+    # 交给后台线程保存为 JSON 格式
+    _enqueue_log(('error_log.json', error_data, 0))
 
 
 def log_detailed_error(unique_id, prompt, system_message, result_format, error, retries):
@@ -63,15 +245,35 @@ def log_detailed_error(unique_id, prompt, system_message, result_format, error,
         "Error": str(error),
         "Retries": retries
     }
-    with open('detailed_error_log.json', 'a', encoding='utf-8') as f:
-        json.dump(error_data, f, ensure_ascii=False, indent=4)
-        f.write('\n')  # 分隔不同的错误日志
+    _enqueue_log(('detailed_error_log.json', error_data, orjson.OPT_INDENT_2))
+
+
+# 计算重试前的等待时间
+def _retry_delay(error: Exception, retries: int) -> float:
+    """
+    计算第 retries 次重试前的等待时间。限流（HTTP 429）且带有 Retry-After 头时按服务端要求等待，
+    否则使用带随机抖动的指数退避，避免并发请求同时重试。
+
+    参数:
+        error (Exception): 本次请求抛出的异常。
+        retries (int): 已失败的次数，从 1 开始。
+
+    返回值:
+        float: 等待的秒数。
+    """
+    if getattr(error, "status", None) == 429:
+        retry_after = (getattr(error, "headers", None) or {}).get("Retry-After")
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            pass  # 没有 Retry-After 或不是秒数格式时，按指数退避处理
+    return min(RETRY_MAX_DELAY, (2 ** retries) + random.random())
 
 
 # 定义一个异步函数，用于与大型语言模型进行交互，获取文本的处理结果
 async def get_completion(prompt: str, system_message: str = "You are a helpful assistant.",
                          model: str = "qwen2-72b-instruct", result_format: str = 'message',
-                         max_retries: int = 5) -> Union[str, dict]:
+                         max_retries: int = 5, result_key: str = 'translate') -> Union[str, list]:
     """
     与大型语言模型进行交互以获取处理结果。包括处理错误、重试机制等。
 
@@ -81,80 +283,53 @@ async def get_completion(prompt: str, system_message: str = "You are a helpful a
         model (str): 使用的模型名称，默认为 "qwen2-72b-instruct"。
         result_format (str): 期望的返回结果格式，默认为 'message'。
         max_retries (int): 最大重试次数，默认为 5。
+        result_key (str): message 格式下从 JSON 结果中取值的字段名，默认为 'translate'。
 
     返回值:
-        Union[str, dict]: 返回的结果，可能是字符串或字典格式。
+        Union[str, list]: 返回的结果，可能是字符串或 result_key 字段对应的值。JSON 结果缺少 result_key 字段时按失败重试，
+            不会把整个字典返回给调用方。
     """
-    loop = asyncio.get_running_loop()  # 获取当前运行的事件循环
     retries = 0  # 初始化重试次数
     unique_id = None  # 预先定义 unique_id 变量
 
     while retries < max_retries:
         try:
-            # 使用 functools.partial 将函数 client_qwen 和参数打包，以便在 run_in_executor 中执行
-            result = await loop.run_in_executor(None, functools.partial(client_qwen, system_message, prompt,
-                                                                        result_format=result_format))
-
-            if result is None:
-                raise ValueError("client_qwen 返回 None")  # 如果结果为空，则抛出异常
-
-            response, token_count = result  # 解包结果
-
-            if result_format == 'message':
-                # 检查 response 是否为字符串，如果是，尝试解析为 JSON
-                if isinstance(response, str):
-                    try:
-                        response = json.loads(response)  # 尝试将字符串解析为 JSON
-                    except json.JSONDecodeError:
-                        print(f"解析失败的结果为：{type(response)}\n{response}")
-                        print(f"解析失败: {traceback.format_exc()}")
-                        pass  # 如果解析失败，保持 response 为字符串
-
-            if isinstance(response, dict) and 'translate' in response and result_format == 'message':
-                # 如果 response 是一个字典并包含 'translate' 字段
-                return response['translate']
-            elif result_format == 'text':
-                # 如果 result_format 是 'txt'，直接返回 response
+            # 直接等待异步客户端，网络请求不再经过默认线程池
+            response, token_count = await aclient_qwen(system_message, prompt, model=model,
+                                                       result_format=result_format)
+
+            # message 格式下 aclient_qwen 已将结果解析为 JSON，未开启 JSON 模式且解析失败时为原始字符串
+            if isinstance(response, dict) and result_key in response and result_format == 'message':
+                # 如果 response 是一个字典并包含 result_key 字段
+                return response[result_key]
+            elif isinstance(response, str):
+                # text 格式，或未能解析为 JSON 的 message 格式结果，直接返回 response
                 return response
             else:
-                print(f"LLM 格式解析错误：{traceback.format_exc()}")
-                return response
+                # 缺少 result_key 字段的 JSON 结果无法使用，按失败处理并重试
+                raise ValueError(f"LLM 结果缺少 {result_key} 字段: {response!r}")
 
         except Exception as e:
-            unique_id = str(uuid.uuid4())  # 生成唯一的错误ID
+            unique_id = _new_error_id()  # 生成唯一的错误ID
             log_error_as_json(unique_id, prompt, system_message, result_format, e)  # 保存为 JSON 日志
             logging.error(f"Error ID: {unique_id} - Error: {str(e)}")  # 同时保存为 TXT 日志
             print(traceback.format_exc())
             retries += 1  # 增加重试次数
-            await asyncio.sleep(5)  # 等待 5 秒后重试
+            if retries < max_retries:
+                await asyncio.sleep(_retry_delay(e, retries))  # 等待后重试
 
     if unique_id is None:
-        unique_id = str(uuid.uuid4())  # 在没有异常的情况下，也生成一个 unique_id
+        unique_id = _new_error_id()  # 在没有异常的情况下，也生成一个 unique_id
 
     return f"\n\n未成功获取LLM结果 - 错误ID: {unique_id}\n\n"  # 返回错误信息给用户
 
 
-# 定义一个异步函数，用于翻译文本块
-async def one_chunk_translation(source_lang: str, target_lang: str, country: str, source_text: str,
-                                result_format: str) -> str:
-    """
-    使用大型语言模型将文本块进行翻译。
-
-    参数:
-        source_lang (str): 源语言的代码。
-        target_lang (str): 目标语言的代码。
-        source_text (str): 要翻译的文本块。
-        country (str): 国家信息，用于翻译的风格匹配。
+# 翻译相关的提示词模板，在模块加载时构建一次，调用时仅做变量替换
+_TRANSLATION_SYSTEM_TMPL = "您是一名翻译专家，专门从事从 {source_lang} 到 {target_lang} 的翻译。最终的翻译风格和语气应与在 {country} 日常口语中的 {target_lang} 风格相匹配。"
 
-    返回值:
-        str: 翻译后的文本块。
-    """
-    # 设置系统消息，指定模型的角色为翻译专家
-    system_message = f"您是一名翻译专家，专门从事从 {source_lang} 到 {target_lang} 的翻译。最终的翻译风格和语气应与在 {country} 日常口语中的 {target_lang} 风格相匹配。"
+_IMPROVE_SYSTEM_TMPL = "您是一名翻译质量审查员，专门从事从 {source_lang} 到 {target_lang} 的翻译质量改进。请确保翻译风格和语气符合在 {country} 日常口语中的 {target_lang} 风格。"
 
-    # 构建翻译提示词，要求将文本从源语言翻译为目标语言
-    if result_format == 'message':
-        translation_prompt = f"""
+_TRANSLATION_TMPL_MSG = """
         以下文本是Markdown格式的文档内容，请将其从 {source_lang} 翻译为 {target_lang}：
         
         注意：
@@ -175,8 +350,8 @@ async def one_chunk_translation(source_lang: str, target_lang: str, country: str
         "translate": 翻译后的文本
         }}
         """
-    else:
-        translation_prompt = f"""
+
+_TRANSLATION_TMPL_TXT = """
         以下文本是Markdown格式的文档内容，请将其从 {source_lang} 翻译为 {target_lang}：
 
         注意：
@@ -194,40 +369,29 @@ async def one_chunk_translation(source_lang: str, target_lang: str, country: str
         请仅输出翻译后的文本内容，保留原始占位符和markdown结构标识，不要添加额外说明或解释。
         """
 
-    # 调用 get_completion 函数获取翻译结果
-    translation = await get_completion(translation_prompt, system_message=system_message, result_format=result_format)
-    return translation  # 返回翻译后的文本
-
-
-# 定义一个异步函数，用于改进翻译文本块
-async def one_chunk_improve_translation(
-        source_lang: str,
-        target_lang: str,
-        country: str,
-        original_text: str,
-        translated_text: str,
-        result_format: str
+_BATCH_TRANSLATION_TMPL = """
+        以下 JSON 数组中每个元素的 text 字段都是Markdown格式的文档内容，请将它们逐个从 {source_lang} 翻译为 {target_lang}：
 
-) -> str:
-    """
-    使用 LLM 对翻译进行改进检查并优化。
+        注意：
+        1. 请严格保留原文的Markdown结构，确保所有的占位符（<PH></PH>）及其包裹的内容不被翻译或修改。对于图片描述，请确保其与图片链接分开处理。
+        2. 请确保严格保留原文中markdown结构的标识，不要新增或者删除markdown标识以带来困惑。
+        3. 遇到作者姓名和参考文献时，请保持原文，不进行翻译。
+        4. 专有名词保留：原文中的专有名词（如人名、地名、品牌名等）应保持不变，避免误译。
+            4.1 不需要翻译的专有名词举例如(不区分大小写)：AI Agent、transformer、LLM、dspy、LangChain等。
+        5. 请仅翻译文本内容，避免对占位符和其他非文本内容进行任何修改。
+        6. 请以标准的 UTF-8 编码返回结果，避免使用 Unicode 转义字符。
+        7. 每个元素单独翻译，不要合并或拆分元素，并保留原有的 id。
 
-    参数:
-        source_lang (str): 源语言的代码。
-        target_lang (str): 目标语言的代码。
-        original_text (str): 原始文本块。
-        translated_text (str): 翻译后的文本块。
-        country (str): 翻译相关的国家信息。
+        原文:
+        {source_items}
 
-    返回值:
-        str: 改进后的翻译文本块。
-    """
-    # 设置系统消息，指定模型的角色为翻译质量审查员
-    system_message = f"您是一名翻译质量审查员，专门从事从 {source_lang} 到 {target_lang} 的翻译质量改进。请确保翻译风格和语气符合在 {country} 日常口语中的 {target_lang} 风格。"
+        请按下文json格式要求输出，不要有其他非json内容，并确保Markdown格式未被改变：
+        {{
+        "translations": [{{"id": 原文元素的id, "translate": 翻译后的文本}}, ...]
+        }}
+        """
 
-    # 构建改进提示词，要求模型根据提供的翻译文本进行改进
-    if result_format == 'message':
-        improvement_prompt = f"""
+_IMPROVE_TMPL_MSG = """
         这是一个针对Markdown格式文档内容的翻译质量改进请求，翻译方向是从 {source_lang} 到 {target_lang}。请根据以下标准对提供的译文进行分析、批评，并基于这些批评和建议改进翻译：
         
         注意：
@@ -267,8 +431,8 @@ async def one_chunk_improve_translation(
         "translate": 改进后的译文
         }}
         """
-    else:
-        improvement_prompt = f"""
+
+_IMPROVE_TMPL_TXT = """
         这是一个针对Markdown格式文档内容的翻译质量改进请求，翻译方向是从 {source_lang} 到 {target_lang}。请根据以下标准对提供的译文进行分析、批评，并基于这些批评和建议改进翻译：
 
         注意：
@@ -300,12 +464,146 @@ async def one_chunk_improve_translation(
         请仅输出改进后的译文文本内容，保留原始占位符和markdown结构标识，不要添加额外说明或解释。
         """
 
+
+@functools.lru_cache(maxsize=32)
+def _translation_system_message(source_lang: str, target_lang: str, country: str) -> str:
+    """按语言和国家组合缓存翻译专家的系统消息。"""
+    return _TRANSLATION_SYSTEM_TMPL.format(source_lang=source_lang, target_lang=target_lang, country=country)
+
+
+@functools.lru_cache(maxsize=32)
+def _improve_system_message(source_lang: str, target_lang: str, country: str) -> str:
+    """按语言和国家组合缓存翻译质量审查员的系统消息。"""
+    return _IMPROVE_SYSTEM_TMPL.format(source_lang=source_lang, target_lang=target_lang, country=country)
+
+
+# 预先替换模板中与文档相关的字段，生成按文本块拼接提示词的函数
+def _prompt_builder(template: str, chunk_fields: Tuple[str, ...], **doc_fields) -> Callable[..., str]:
+    """
+    将模板中整篇文档都相同的字段（如语言、国家）一次性替换，返回的函数只需按顺序拼入文本块相关的字段，
+    结果与直接对模板调用 format_map 相同。
+
+    参数:
+        template (str): 提示词模板。
+        chunk_fields (Tuple[str, ...]): 每个文本块不同的字段名，返回函数的位置参数按此顺序传入。
+        **doc_fields: 整篇文档相同的字段取值。
+
+    返回值:
+        Callable[..., str]: 接收文本块字段取值并返回完整提示词的函数。
+    """
+    sentinels = {name: f"\x00{name}\x00" for name in chunk_fields}
+    filled = template.format_map({**doc_fields, **sentinels})
+    pieces = re.split("(%s)" % "|".join(re.escape(sentinel) for sentinel in sentinels.values()), filled)
+
+    def build(*values: str) -> str:
+        # 与 format_map 一致，非字符串取值（如未能取出翻译字段的字典结果）按 str() 拼入
+        mapping = dict(zip(sentinels.values(), map(str, values)))
+        return "".join(mapping.get(piece, piece) for piece in pieces)
+
+    return build
+
+
+# 定义一个异步函数，用于翻译文本块
+async def one_chunk_translation(system_message: str, prompt_template: Callable[[str], str], source_text: str,
+                                result_format: str) -> str:
+    """
+    使用大型语言模型将文本块进行翻译。
+
+    参数:
+        system_message (str): 翻译专家的系统消息，整篇文档共用。
+        prompt_template (Callable[[str], str]): 根据文本块生成翻译提示词的函数，整篇文档共用。
+        source_text (str): 要翻译的文本块。
+        result_format (str): 期望的返回结果格式。
+
+    返回值:
+        str: 翻译后的文本块。
+    """
+    # 调用 get_completion 函数获取翻译结果
+    translation = await get_completion(prompt_template(source_text), system_message=system_message,
+                                       result_format=result_format)
+    return translation  # 返回翻译后的文本
+
+
+# 定义一个异步函数，用于在一次请求中翻译多个文本块
+async def batch_translate(system_message: str, batch_prompt_template: Callable[[str], str], chunks: List[str]
+                          ) -> List[Union[str, None]]:
+    """
+    将多个文本块打包为一个 JSON 数组，通过一次 LLM 请求完成翻译，以减少请求次数和重复的系统消息开销。
+    批量请求只尝试一次，返回结果无法解析或缺少某些块时，对应位置为 None，由调用方逐块重新翻译。
+
+    参数:
+        system_message (str): 翻译专家的系统消息，整篇文档共用。
+        batch_prompt_template (Callable[[str], str]): 根据 JSON 数组生成批量翻译提示词的函数。
+        chunks (List[str]): 要翻译的文本块列表。
+
+    返回值:
+        List[Union[str, None]]: 与 chunks 一一对应的翻译结果，未成功翻译的块为 None。
+    """
+    source_items = orjson.dumps([{"id": i, "text": chunk} for i, chunk in enumerate(chunks)]).decode()
+
+    translations: List[Union[str, None]] = [None] * len(chunks)
+    # 解析失败时直接回退为逐块翻译，不在占用并发名额的情况下反复重试整个批次
+    response = await get_completion(batch_prompt_template(source_items), system_message=system_message,
+                                    result_format='message', max_retries=1, result_key='translations')
+    if isinstance(response, list):
+        for item in response:
+            # 按 id 放回原来的位置，忽略格式不正确的元素
+            if isinstance(item, dict) and isinstance(item.get("translate"), str) \
+                    and isinstance(item.get("id"), int) and 0 <= item["id"] < len(chunks):
+                translations[item["id"]] = item["translate"]
+
+    missing = sum(translation is None for translation in translations)
+    if missing:
+        ic("批量翻译结果不完整，需逐块翻译的块数：", missing)
+    return translations
+
+
+# 定义一个异步函数，用于改进翻译文本块
+async def one_chunk_improve_translation(
+        system_message: str,
+        prompt_template: Callable[[str, str], str],
+        original_text: str,
+        translated_text: str,
+        result_format: str
+
+) -> str:
+    """
+    使用 LLM 对翻译进行改进检查并优化。
+
+    参数:
+        system_message (str): 翻译质量审查员的系统消息，整篇文档共用。
+        prompt_template (Callable[[str, str], str]): 根据原文和译文生成改进提示词的函数，整篇文档共用。
+        original_text (str): 原始文本块。
+        translated_text (str): 翻译后的文本块。
+        result_format (str): 期望的返回结果格式。
+
+    返回值:
+        str: 改进后的翻译文本块。
+    """
     # 调用 get_completion 函数获取改进后的翻译结果
-    improved_translation = await get_completion(improvement_prompt, system_message=system_message,
-                                                result_format=result_format)
+    improved_translation = await get_completion(prompt_template(original_text, translated_text),
+                                                system_message=system_message, result_format=result_format)
     return improved_translation  # 返回改进后的翻译文本
 
 
+# 缓存编码器对象，避免每次计数都重新构建 BPE 表
+@functools.lru_cache(maxsize=8)
+def _get_encoding(name: str) -> tiktoken.Encoding:
+    """
+    获取指定名称的 tiktoken 编码器，结果会被缓存。
+
+    参数:
+        name (str): 编码名称，例如 "cl100k_base"。
+
+    返回值:
+        tiktoken.Encoding: 对应的编码器对象。
+    """
+    global _tiktoken
+    if _tiktoken is None:
+        _tiktoken = importlib.import_module("tiktoken")
+    return _tiktoken.get_encoding(name)
+
+
 # 计算输入字符串中的标记数量
 def num_tokens_in_string(input_str: str, encoding_name: str = "cl100k_base") -> int:
     """
@@ -318,9 +616,23 @@ def num_tokens_in_string(input_str: str, encoding_name: str = "cl100k_base") ->
     返回值:
         int: 字符串中的标记数量。
     """
-    encoding = tiktoken.get_encoding(encoding_name)  # 获取指定编码
-    num_tokens = len(encoding.encode(input_str))  # 编码输入字符串并计算标记数量
-    return num_tokens  # 返回标记数量
+    return len(_get_encoding(encoding_name).encode(input_str))  # 编码输入字符串并计算标记数量
+
+
+def _token_lens(enc: tiktoken.Encoding, texts: List[str]) -> List[int]:
+    """
+    计算每段文本的标记数。文本总量较大且有多个可用 CPU 时才使用多线程批量编码。
+
+    参数:
+        enc (tiktoken.Encoding): 编码器。
+        texts (List[str]): 文本列表。
+
+    返回值:
+        List[int]: 与 texts 一一对应的标记数。
+    """
+    if ENCODE_THREADS > 1 and len(texts) > 1 and sum(map(len, texts)) >= ENCODE_BATCH_MIN_CHARS:
+        return [len(tokens) for tokens in enc.encode_ordinary_batch(texts, num_threads=ENCODE_THREADS)]
+    return [len(enc.encode_ordinary(text)) for text in texts]
 
 
 # 计算分块大小，确保文本块不超过指定的标记限制
@@ -348,6 +660,87 @@ def calculate_chunk_size(token_count: int, token_limit: int) -> int:
     return chunk_size  # 返回计算后的块大小
 
 
+# 在片段标记数序列上滑动窗口，找出每个块的结束位置
+def _walk_window_py(lens: List[int], min_tokens: float, max_tokens: float) -> List[int]:
+    """
+    依次累加片段的标记数，累计值落在 [min_tokens, max_tokens] 区间时在此处切分并重新计数。
+
+    参数:
+        lens (List[int]): 各片段的标记数。
+        min_tokens (float): 每个块的最小标记数。
+        max_tokens (float): 每个块的最大标记数。
+
+    返回值:
+        List[int]: 每个块结束位置（不含）的片段下标。
+    """
+    boundaries = []
+    running = 0
+    for end, part_len in enumerate(lens, 1):
+        running += part_len
+        if min_tokens <= running <= max_tokens:
+            boundaries.append(end)
+            running = 0
+    return boundaries
+
+
+def _walk_window_kernel(lens, min_tokens, max_tokens, boundaries):
+    """
+    _walk_window_py 的数组版本，供 numba 编译。结束位置写入预先分配的 boundaries 数组，返回写入的个数。
+    """
+    count = 0
+    running = 0
+    for i in range(lens.shape[0]):
+        running += lens[i]
+        if min_tokens <= running <= max_tokens:
+            boundaries[count] = i + 1
+            count += 1
+            running = 0
+    return count
+
+
+# 实际使用的窗口扫描函数，首次调用 _walk_window 时根据 numba 是否可用确定
+_walk_window_impl = None
+
+
+def _load_walk_window() -> Callable[[List[int], float, float], List[int]]:
+    """
+    numba 可用时返回编译后的数组版本，否则返回纯 Python 版本。
+    未安装 numba 时逐个处理 numpy 标量比处理 Python 整数慢得多，因此只在编译路径上构建数组。
+    """
+    try:
+        numba = importlib.import_module("numba")
+        np = importlib.import_module("numpy")
+    except ImportError:
+        return _walk_window_py
+
+    kernel = numba.njit(cache=True)(_walk_window_kernel)
+
+    def walk_window_jit(lens: List[int], min_tokens: float, max_tokens: float) -> List[int]:
+        boundaries = np.empty(len(lens), dtype=np.int64)
+        count = kernel(np.asarray(lens, dtype=np.int32), min_tokens, max_tokens, boundaries)
+        return boundaries[:count].tolist()
+
+    return walk_window_jit
+
+
+def _walk_window(lens: List[int], min_tokens: float, max_tokens: float) -> List[int]:
+    """
+    在片段标记数序列上滑动窗口，返回每个块结束位置（不含）的片段下标。numba 在首次调用时才导入。
+
+    参数:
+        lens (List[int]): 各片段的标记数。
+        min_tokens (float): 每个块的最小标记数。
+        max_tokens (float): 每个块的最大标记数。
+
+    返回值:
+        List[int]: 每个块结束位置（不含）的片段下标。
+    """
+    global _walk_window_impl
+    if _walk_window_impl is None:
+        _walk_window_impl = _load_walk_window()
+    return _walk_window_impl(lens, min_tokens, max_tokens)
+
+
 # 根据最大标记数拆分文本
 # 进行优先级分割
 def split_text(text: str, max_tokens: int, token_flexibility: float = 0.5) -> List[str]:
@@ -365,12 +758,7 @@ def split_text(text: str, max_tokens: int, token_flexibility: float = 0.5) -> Li
     min_tokens = max_tokens * (1 - token_flexibility)
     max_tokens_flex = max_tokens * (1 + token_flexibility)
 
-    # 优先级 1: 标题分割
-    title_split_pattern = re.compile(r'(\n#+\s)')
-    # 优先级 2: 段落分割
-    paragraph_split_pattern = re.compile(r'(\n{2,})')
-    # 优先级 3: 句子结束符分割
-    sentence_split_pattern = re.compile(r'([\.\!\?]\s)')
+    enc = _get_encoding("cl100k_base")  # 编码器只获取一次，供内部循环复用
 
     chunks = []
     current_chunk = ""
@@ -386,29 +774,25 @@ def split_text(text: str, max_tokens: int, token_flexibility: float = 0.5) -> Li
         返回值:
             str: 分割后剩余的未处理文本。
         """
-        parts = re.split(pattern, chunk)
-        new_chunk = ""
-        for part in parts:
-            temp_chunk = new_chunk + part
-            token_count = num_tokens_in_string(temp_chunk)
-
-            if min_tokens <= token_count <= max_tokens_flex:
-                chunks.append(temp_chunk.strip())
-                new_chunk = ""
-            else:
-                new_chunk += part
-        return new_chunk
+        parts = pattern.split(chunk)
+        # 每个片段只编码一次，按片段标记数累加，避免对不断增长的缓冲区重复编码
+        lens = _token_lens(enc, parts)
+        start = 0  # 当前窗口起始片段的下标
+        for end in _walk_window(lens, min_tokens, max_tokens_flex):
+            chunks.append("".join(parts[start:end]).strip())
+            start = end
+        return "".join(parts[start:])
 
     # 尝试按照标题分割
-    current_chunk = try_split(title_split_pattern, text)
+    current_chunk = try_split(_TITLE_RE, text)
 
     # 如果剩余内容仍然存在，尝试按照段落分割
     if current_chunk:
-        current_chunk = try_split(paragraph_split_pattern, current_chunk)
+        current_chunk = try_split(_PARA_RE, current_chunk)
 
     # 如果仍然有剩余内容，尝试按照句子结束符分割
     if current_chunk:
-        current_chunk = try_split(sentence_split_pattern, current_chunk)
+        current_chunk = try_split(_SENT_RE, current_chunk)
 
     # 添加剩余的部分
     if current_chunk:
@@ -417,6 +801,54 @@ def split_text(text: str, max_tokens: int, token_flexibility: float = 0.5) -> Li
     return chunks
 
 
+# 按标记数将文本块分组，用于批量翻译
+def group_chunks_by_tokens(chunks: List[str], max_tokens: int) -> List[List[int]]:
+    """
+    将连续的文本块分组，使每组的标记总数不超过 max_tokens。单个文本块超过限制时单独成组。
+
+    参数:
+        chunks (List[str]): 文本块列表。
+        max_tokens (int): 每组的最大标记数量。
+
+    返回值:
+        List[List[int]]: 每组包含的文本块下标。
+    """
+    lens = _token_lens(_get_encoding("cl100k_base"), chunks)
+    groups = []
+    current = []
+    running = 0
+    for index, chunk_len in enumerate(lens):
+        if current and running + chunk_len > max_tokens:
+            groups.append(current)
+            current = []
+            running = 0
+        current.append(index)
+        running += chunk_len
+    if current:
+        groups.append(current)
+    return groups
+
+
+# 各事件循环中按并发上限复用的信号量，多次调用 translate_markdown 时共享同一并发限制
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+
+def _get_semaphore(semaphore_limit: int) -> Semaphore:
+    """
+    获取当前事件循环中并发上限为 semaphore_limit 的共享信号量，不存在时创建。
+
+    参数:
+        semaphore_limit (int): 最大并发任务数。
+
+    返回值:
+        Semaphore: 共享的信号量对象。
+    """
+    loop_semaphores = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    if semaphore_limit not in loop_semaphores:
+        loop_semaphores[semaphore_limit] = Semaphore(semaphore_limit)
+    return loop_semaphores[semaphore_limit]
+
+
 # 在信号量的控制下运行异步任务
 async def run_with_semaphore(semaphore, coro):
     """
@@ -441,7 +873,8 @@ async def translate_markdown(
         source_text: str,
         max_tokens: int = TOKENS_PER_CHUNK,
         semaphore_limit: int = 5,
-        result_format: str = 'message'
+        result_format: str = 'message',
+        batch_max_tokens: int = 0
 ) -> str:
     """
     使用大型语言模型将Markdown格式的文本进行分块翻译和优化。
@@ -453,64 +886,154 @@ async def translate_markdown(
         source_text (str): 要翻译的Markdown格式文本。
         max_tokens (int): 每个块的最大标记数量，默认为 800。
         semaphore_limit (int): 最大并发任务数，默认为 5。
+        batch_max_tokens (int): 大于 0 时，将标记总数不超过该值的相邻块合并为一次请求进行初次翻译，默认为 0（不合并）。
 
     返回值:
         str: 翻译后的Markdown格式文本。
     """
-    semaphore = Semaphore(semaphore_limit)  # 创建一个信号量，用于限制并发任务的数量
-    num_tokens_in_text = num_tokens_in_string(source_text)  # 计算文本中的标记数量
-    ic("文本的 token 数:", num_tokens_in_text)
+    semaphore = _get_semaphore(semaphore_limit)  # 获取共享的信号量，用于限制并发任务的数量
 
-    failed_chunks = []
+    # 系统消息和提示词模板对整篇文档只构建一次，每个文本块只需拼入自身内容
+    doc_fields = {"source_lang": source_lang, "target_lang": target_lang, "country": country}
+    translation_system_message = _translation_system_message(source_lang, target_lang, country)
+    improve_system_message = _improve_system_message(source_lang, target_lang, country)
+    if result_format == 'message':
+        translation_template, improve_template = _TRANSLATION_TMPL_MSG, _IMPROVE_TMPL_MSG
+    else:
+        translation_template, improve_template = _TRANSLATION_TMPL_TXT, _IMPROVE_TMPL_TXT
+    make_translation_prompt = _prompt_builder(translation_template, ("source_text",), **doc_fields)
+    make_improve_prompt = _prompt_builder(improve_template, ("original_text", "translated_text"), **doc_fields)
+
+    # 先按平均每个标记约 4 个字符粗略估算。英文文本每个标记通常多于 4 个字符，估算值略超上限的文本实际可能放得进一个块，
+    # 因此只有估算值达到上限两倍、明显需要分块时才跳过对整篇文档的完整编码，直接交给 split_text；其余情况精确计数，
+    # 避免把本可一次翻译的文本拆成多个请求而丢失块间上下文
+    estimated_tokens = len(source_text) // 4
+    if estimated_tokens >= 2 * max_tokens:
+        ic("文本的估算 token 数:", estimated_tokens)
+        needs_split = True
+    else:
+        num_tokens_in_text = num_tokens_in_string(source_text)  # 计算文本中的标记数量
+        ic("文本的 token 数:", num_tokens_in_text)
+        needs_split = num_tokens_in_text >= max_tokens
 
-    async def process_chunk(chunk, index, retries=0) -> str:
+    async def process_chunk(chunk, initial_translation=None) -> str:
         """
-        处理单个文本块，包括翻译和改进。支持错误处理和重试机制。
+        处理单个文本块，包括翻译和改进。出现异常时直接抛出，由调用方决定是否重试。
 
         参数:
             chunk (str): 要处理的文本块。
-            index (int): 文本块的索引位置。
-            retries (int): 当前处理时的重试次数，默认为 0。
+            initial_translation (str): 已有的初次翻译结果（如批量翻译得到的），提供时跳过初次翻译。
 
         返回值:
             str: 处理后的文本块结果。
         """
-        try:
+        if initial_translation is None:
             initial_translation = await run_with_semaphore(
-                semaphore, one_chunk_translation(source_lang, target_lang, country, chunk, result_format=result_format)
-            )
-            improved_translation = await run_with_semaphore(
                 semaphore,
-                one_chunk_improve_translation(source_lang, target_lang, country, chunk, initial_translation,
-                                              result_format=result_format)
+                one_chunk_translation(translation_system_message, make_translation_prompt, chunk,
+                                      result_format=result_format)
             )
-            return improved_translation
-        except Exception as e:
-            print(traceback.format_exc())
-            if retries >= 5:
-                unique_id = str(uuid.uuid4())
-                log_detailed_error(unique_id, chunk, "", "", e, retries)
-                failed_chunks.append((index, chunk))  # 保留失败的块及其索引
-                return f"\n\n未成功获取LLM结果 - 错误ID: {unique_id}\n\n"
-            else:
-                return await process_chunk(chunk, index, retries + 1)
-
-    if num_tokens_in_text < max_tokens:
+        improved_translation = await run_with_semaphore(
+            semaphore,
+            one_chunk_improve_translation(improve_system_message, make_improve_prompt, chunk, initial_translation,
+                                          result_format=result_format)
+        )
+        return improved_translation
+
+    if not needs_split:
         ic("文本将在单个块中翻译")
-        return await process_chunk(source_text, 0)
+        source_text_chunks = [source_text]
     else:
         ic("文本将被分割并翻译")
         source_text_chunks = split_text(source_text, max_tokens)
         ic("文本被分割成的块数：", len(source_text_chunks))
-        translated_chunks: List[str] = list(
-            await asyncio.gather(*[process_chunk(chunk, index) for index, chunk in enumerate(source_text_chunks)]))
 
-        # 如果有失败的块，再次尝试处理
-        if failed_chunks:
-            ic("重试失败的块")
-            retry_results = await asyncio.gather(*[process_chunk(chunk, index) for index, chunk in failed_chunks])
+    initial_translations: List[Union[str, None]] = [None] * len(source_text_chunks)
+    if batch_max_tokens > 0 and len(source_text_chunks) > 1:
+        # 将相邻的块合并为批次，一次请求完成多个块的初次翻译
+        batches = group_chunks_by_tokens(source_text_chunks, batch_max_tokens)
+        ic("初次翻译合并后的请求数：", len(batches))
+        make_batch_prompt = _prompt_builder(_BATCH_TRANSLATION_TMPL, ("source_items",), **doc_fields)
+        batch_results = await asyncio.gather(*[
+            run_with_semaphore(semaphore, batch_translate(translation_system_message, make_batch_prompt,
+                                                          [source_text_chunks[i] for i in batch]))
+            for batch in batches])
+        # 批量翻译缺失的块保持为 None，之后在 process_chunk 中受信号量限制逐块翻译
+        for batch, results in zip(batches, batch_results):
+            for index, translation in zip(batch, results):
+                initial_translations[index] = translation
+
+    # 待处理队列中的元素为 (块索引, 文本块, 已重试次数)，失败的块会立即放回队列重试，
+    # 与其他块的请求重叠进行，而不是等全部块完成后再统一重试
+    work_queue: asyncio.Queue = asyncio.Queue()
+    for index, chunk in enumerate(source_text_chunks):
+        work_queue.put_nowait((index, chunk, 0))
+
+    # 按块顺序写入结果；先完成的后序块暂存在 pending 中，等前面的块写出后再写入
+    output = io.StringIO()
+    pending = {}
+    next_index = 0
+
+    def emit(index: int, text: str):
+        """记录第 index 块的结果，并写出从 next_index 开始已连续完成的块。"""
+        nonlocal next_index
+        pending[index] = text
+        while next_index in pending:
+            if next_index:
+                output.write("\n\n")
+            output.write(pending.pop(next_index))
+            next_index += 1
+
+    async def worker():
+        """从队列中取出文本块进行处理，直到队列为空。"""
+        while not work_queue.empty():
+            index, chunk, retries = work_queue.get_nowait()
+            try:
+                result = await process_chunk(chunk, initial_translations[index])
+                if not isinstance(result, str):
+                    # 未能取出翻译字段时 LLM 结果可能是字典等其他类型，按失败处理
+                    raise TypeError(f"LLM 结果不是字符串: {result!r}")
+            except Exception as e:
+                print(traceback.format_exc())
+                if retries >= CHUNK_MAX_RETRIES:
+                    unique_id = _new_error_id()
+                    log_detailed_error(unique_id, chunk, "", "", e, retries)
+                    result = f"\n\n未成功获取LLM结果 - 错误ID: {unique_id}\n\n"
+                else:
+                    work_queue.put_nowait((index, chunk, retries + 1))
+                    continue
+            # 写出结果放在 try 之外，写出时的异常不会被当作本块处理失败而重新入队
+            emit(index, result)
+
+    await asyncio.gather(*[worker() for _ in range(min(semaphore_limit, len(source_text_chunks)))])
+
+    return output.getvalue()
+
+
+# 预加载编码的后台线程，只启动一次
+_warm_thread: "threading.Thread | None" = None
+_warm_lock = threading.Lock()
+
+
+def _warm_encoding_target():
+    """
+    预加载 cl100k_base 编码，失败时只记录一行警告。
+    """
+    try:
+        _get_encoding("cl100k_base")
+    except Exception as e:
+        # 预加载失败（如离线环境）不影响使用，首次计数时会再次尝试加载并抛出真正的错误
+        logging.warning(f"预加载 tiktoken 编码失败: {e!r}")
 
-            for (index, _), retry_result in zip(failed_chunks, retry_results):
-                translated_chunks[index] = retry_result  # 放回原来的位置
 
-        return "\n\n".join(translated_chunks)
+def warm_encoding():
+    """
+    在后台线程中预先加载 cl100k_base 编码，使 tiktoken 的导入、BPE 文件下载和构建与调用方的其他工作重叠，
+    首次分块时无需再等待。重复调用不会重复启动线程。导入本模块时不会自动预加载，需要时由调用方显式调用。
+    """
+    global _warm_thread
+    with _warm_lock:
+        if _warm_thread is None:
+            _warm_thread = threading.Thread(target=_warm_encoding_target, name="translate-tiktoken-warmup",
+                                            daemon=True)
+            _warm_thread.start()